@@ -11,22 +11,38 @@
 # Imports
 #####################################################################
 from __future__ import print_function, division, unicode_literals  # Not necessary for Python 3
-from __future__ import
 
+import os
 import re
+import ast
 import csv
 import math
 import json
 import requests
+import numpy as np
+import scipy.sparse as sp
 from time import time
 from sklearn.cluster import KMeans
+from sklearn.externals import joblib
+from sklearn.feature_extraction import text
+from sklearn.feature_extraction.text import TfidfVectorizer, TfidfTransformer
 from textblob import TextBlob as tb
 
 #####################################################################
 # Global Variables
 #####################################################################
-file_name = "lda_clusters.txt"
+file_name = "lda_clusters_v2.csv"   # Cluster words written by lda_tag.py
+topic_model = "lda"                 # Score with the saved "lda" or "nmf" model
+model_files = {"lda": "lda_model_v2.pkl",   # Saved by lda_tag.py
+               "nmf": "nmf_model.pkl"}      # Saved by nmf_tag.py
 data_URL = "https://data.noaa.gov/data.json"
+cluster_scoring = True
+
+# Same stop words as lda_tag.py, so the fallback vectorizer builds the
+# same bigrams as the clusters in file_name
+domain_stops = ["department","commerce","doc","noaa","national", "data", \
+                "centers", "united", "states", "administration"]
+stopwords = text.ENGLISH_STOP_WORDS.union(domain_stops)
 
 #####################################################################
 # Pull records from URL & load clusters from disk
@@ -47,9 +63,103 @@ def get_records(URL):
     return data_samples
 
 def get_clusters(fname):
-    with open(file_name, 'rb') as f:
-        for line in f:
-            yield line
+    """
+    Reads the cluster csv written by lda_tag.py and yields the list of top
+    terms for each cluster. Terms are kept whole, so bigrams like
+    "sea surface" stay one term.
+    """
+    with open(fname, 'rb') as f:
+        rdr = csv.reader(f)
+        next(rdr, None)
+        for row in rdr:
+            terms = ast.literal_eval(row[1])
+            yield [t.decode('utf-8') if isinstance(t, bytes) else t for t in terms]
+
+def get_model(fname):
+    """
+    Loads a vectorizer and model saved by lda_tag.py or nmf_tag.py and
+    returns the topic-word weights (components_) and the vectorizer.
+    """
+    saved = joblib.load(fname)
+    if "components" in saved:
+        return saved["components"], saved["vectorizer"]
+    return saved["lda"].components_, saved["vectorizer"]
+
+def record_features(vectorizer, texts):
+    """
+    Returns the TF-IDF matrix of texts in the vectorizer's own feature
+    space, so its columns line up with the model's components_.
+    """
+    if isinstance(vectorizer, TfidfVectorizer):
+        return vectorizer.transform(texts)
+    return TfidfTransformer().fit_transform(vectorizer.transform(texts))
+
+#######################################################################
+# Cluster-aware TF-IDF scoring
+#######################################################################
+def normalize_rows(matrix):
+    """
+    L2-normalizes the rows of a sparse matrix, leaving empty rows alone.
+    """
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sp.diags(1 / norms, 0).dot(matrix).tocsr()
+
+def cluster_matrix(clusters, vocabulary):
+    """
+    Builds a sparse (n_clusters x n_features) topic-word matrix from lists
+    of cluster terms, using the column indices in vocabulary. Terms the
+    vectorizer doesn't know are dropped. Every term gets the same weight,
+    so prefer components_matrix when the fitted model is available.
+    """
+    indptr = [0]
+    indices = []
+    for words in clusters:
+        indices.extend(set(vocabulary[w] for w in words if w in vocabulary))
+        indptr.append(len(indices))
+    data = np.ones(len(indices))
+    topics = sp.csr_matrix((data, indices, indptr),
+                           shape=(len(indptr) - 1, len(vocabulary)))
+    return normalize_rows(topics)
+
+def components_matrix(components, n_top_words=30):
+    """
+    Builds the sparse topic-word matrix from the top n_top_words of each
+    topic in the components_ of a fitted NMF or LDA model, keeping their
+    weights. Columns are the model's own features.
+    """
+    n_topics, n_features = components.shape
+    rows, cols, data = [], [], []
+    for topic_idx, topic in enumerate(components):
+        for i in topic.argsort()[:-n_top_words - 1:-1]:
+            rows.append(topic_idx)
+            cols.append(i)
+            data.append(topic[i])
+    topics = sp.csr_matrix((data, (rows, cols)), shape=(n_topics, n_features))
+    return normalize_rows(topics)
+
+def cluster_scores(tfidf, topics):
+    """
+    Scores every candidate tag for every record at once. tfidf * topics.T
+    gives each record's relevance to each cluster; multiplying by topics
+    again spreads that over the cluster words, so a word scores highly
+    when the record leans towards the clusters the word is central to.
+    """
+    return tfidf.dot(topics.T).dot(topics).tocsr()
+
+def cluster_save(scores, feature_names, recordlist, path, n=5):
+    """
+    Save n suggested tags per record to csv (defaults to top 5)
+    """
+    with open(path, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(["noaa_record","suggested_tags","cluster_score"])
+        for i in range(scores.shape[0]):
+            start, end = scores.indptr[i], scores.indptr[i + 1]
+            cols, vals = scores.indices[start:end], scores.data[start:end]
+            writer.writerow([recordlist[i]])
+            for j in (-vals).argsort()[:n]:
+                writer.writerow(["",feature_names[cols[j]],round(vals[j], 5)])
 
 #######################################################################
 # Base TF-IDF Implementation
@@ -112,9 +222,6 @@ def scoreSave(bloblist,path,n=5):
                 writer.writerow(["",word,round(score, 5)])
 
 if __name__ == "__main__":
-    records = get_records(data_URL)
-    for record in records:
-
     # Note: vect_dict.csv is a dictionary created via rubyexplr.py and contains
     # the first 500 NOAA json records stored with 'identifier' as the key
     # and text from the 'title', 'keyword' and 'description' fields as the values.
@@ -128,6 +235,28 @@ if __name__ == "__main__":
             noaa_recordlist.append(document_name)
             noaa_bloblist.append(tb(document_text))
 
-    # blobPrint(noaa_bloblist)
+    if cluster_scoring:
+        # Score every record against the topic clusters in one sparse product
+        t0 = time()
+        texts = [blob.raw for blob in noaa_bloblist]
+        model_file = model_files[topic_model]
+        if os.path.exists(model_file):
+            # Weight each cluster term by its components_ weight, scoring in
+            # the model's own feature space
+            components, vectorizer = get_model(model_file)
+            tfidf = record_features(vectorizer, texts)
+            topics = components_matrix(components)
+        else:
+            print("%s not found, weighting the terms in %s equally..."
+                  % (model_file, file_name))
+            vectorizer = TfidfVectorizer(ngram_range=(1,2), stop_words=stopwords)
+            tfidf = vectorizer.fit_transform(texts)
+            topics = cluster_matrix(get_clusters(file_name), vectorizer.vocabulary_)
+        scores = cluster_scores(tfidf, topics)
+        cluster_save(scores, vectorizer.get_feature_names(), noaa_recordlist,
+                     "cluster_tags.csv")
+        print("done in %0.3fs." % (time() - t0))
+    else:
+        # blobPrint(noaa_bloblist)
 
-    scoreSave(noaa_bloblist,"test_tags.csv")
+        scoreSave(noaa_bloblist,"test_tags.csv")
@@ -19,6 +19,7 @@ Notes: In LDA, time complexity is proportional to (n_samples * iterations).
 from __future__ import print_function  # Not necessary for Python 3
 from time import time
 
+import os
 import re
 import csv
 import json
@@ -28,6 +29,8 @@ import numpy as np
 from sklearn.feature_extraction import text
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.decomposition import LatentDirichletAllocation
+from sklearn.externals import joblib
+from tag_cache import TagCache, modelVersion
 
 #####################################################################
 # Global Variables
@@ -35,10 +38,18 @@ from sklearn.decomposition import LatentDirichletAllocation
 conn=pymongo.MongoClient()
 db = conn.earthwindfire
 noaa_coll = db.noaa_coll
+cache_coll = db.tag_cache
 
 n_features = 200000
 n_topics = 50
 n_top_words = 30
+max_iter = 5
+holdout = False   # Leave out the keyword field so tag_eval.py can score against it
+clusters_file = 'lda_clusters_v2_holdout.csv' if holdout else 'lda_clusters_v2.csv'
+records_file = ('records_to_ldaclusters_v2_holdout.csv' if holdout
+                else 'records_to_ldaclusters_v2.csv')
+model_file = 'lda_model_v2_holdout.pkl' if holdout else 'lda_model_v2.pkl'
+refit = False     # Refit & overwrite model_file even if it exists
 
 domain_stops = ["department","commerce","doc","noaa","national", "data", \
                 "centers", "united", "states", "administration"]
@@ -102,22 +113,24 @@ def loadData(URL,collection):
             collection.insert_one(data)
         print("Successfully loaded %d records into MongoDB." % collection.count())
 
-def wrangleData(collection):
+def wrangleData(collection, keywords=True):
     """
     Reads in MongoDB documents, extracts and joins the content from the relevant
     fields for each record (keyword, title, description) and returns a list.
+    If keywords is False the keyword field is held out.
     """
     data_samples = []
     for entry in collection.find():
         title = " ".join(filter(lambda x: x.isalpha(), entry[u'title'].split()))
         description = " ".join(filter(lambda x: x.isalpha(), entry[u'description'].split()))
-        keywords = " ".join(filter(lambda x: x.isalpha(), entry[u'keywords']))
-        data_samples.append(title+" "+description+" "+keywords)
+        if keywords:
+            description += " " + " ".join(filter(lambda x: x.isalpha(), entry[u'keywords']))
+        data_samples.append(title+" "+description)
     return data_samples
 
 
 if __name__ == '__main__':
-    with open('lda_clusters_v2.csv', 'wb') as f1:
+    with open(clusters_file, 'wb') as f1:
         writer = csv.writer(f1)
         writer.writerow(["cluster","top words"])
 
@@ -128,28 +141,52 @@ if __name__ == '__main__':
         print("Checking to see if you have the data...")
         loadData("https://data.noaa.gov/data.json",noaa_coll)
 
-        noaa_samples = wrangleData(noaa_coll)
+        noaa_samples = wrangleData(noaa_coll, keywords=not holdout)
         print("done in %0.3fs." % (time() - t0))
         # Restart the clock
         t0 = time()
 
-        # Extract raw term counts to compute term frequency.
-        print("Extracting term frequency features for LDA...")
-        tf_vectorizer = CountVectorizer(max_df=0.95, min_df=2, ngram_range=(1,2),
-                                        stop_words=stopwords)
-        tf = tf_vectorizer.fit_transform(noaa_samples)
-        print("done in %0.3fs." % (time() - t0))
-
-        # Restart the clock
-        t0 = time()
-
-        # Fit the LDA model
-        print("Fitting LDA model with term frequency features, n_samples=%d and n_features=%d..."
-            % (len(noaa_samples), n_features))
-        lda = LatentDirichletAllocation(n_topics=n_topics, max_iter=5, learning_offset=50.,
-                                        random_state=0)
-        lda.fit(tf)
-        print("done in %0.3fs." % (time() - t0))
+        saved = None
+        if not refit and os.path.exists(model_file):
+            saved = joblib.load(model_file)
+            if (saved.get("n_topics"), saved.get("max_iter")) != (n_topics, max_iter):
+                print("%s was fitted with n_topics=%s, max_iter=%s; refitting..."
+                      % (model_file, saved.get("n_topics"), saved.get("max_iter")))
+                saved = None
+
+        if saved is not None:
+            # Reuse the saved vectorizer & model so the cache stays valid
+            print("Using saved LDA model from %s..." % model_file)
+            if saved["n_samples"] != len(noaa_samples):
+                print("Note: model was fitted on %d records, there are now %d; "
+                      "set refit = True to pick up new vocabulary."
+                      % (saved["n_samples"], len(noaa_samples)))
+            tf_vectorizer, lda, model_version = saved["vectorizer"], saved["lda"], saved["version"]
+            tf = tf_vectorizer.transform(noaa_samples)
+            print("done in %0.3fs." % (time() - t0))
+        else:
+            # Extract raw term counts to compute term frequency.
+            print("Extracting term frequency features for LDA...")
+            tf_vectorizer = CountVectorizer(max_df=0.95, min_df=2, ngram_range=(1,2),
+                                            stop_words=stopwords)
+            tf = tf_vectorizer.fit_transform(noaa_samples)
+            print("done in %0.3fs." % (time() - t0))
+
+            # Restart the clock
+            t0 = time()
+
+            # Fit the LDA model
+            print("Fitting LDA model with term frequency features, n_samples=%d and n_features=%d..."
+                % (len(noaa_samples), n_features))
+            lda = LatentDirichletAllocation(n_topics=n_topics, max_iter=max_iter, learning_offset=50.,
+                                            random_state=0)
+            lda.fit(tf)
+            model_version = modelVersion(lda, tf_vectorizer.get_feature_names())
+            joblib.dump({"vectorizer": tf_vectorizer, "lda": lda, "version": model_version,
+                         "n_topics": n_topics, "max_iter": max_iter,
+                         "n_samples": len(noaa_samples)},
+                        model_file)
+            print("done in %0.3fs." % (time() - t0))
 
         # Save the clusters
         tf_feature_names = tf_vectorizer.get_feature_names()
@@ -160,7 +197,7 @@ if __name__ == '__main__':
         # printClusters(lda, tf_feature_names, n_top_words)
 
     # Now match up the records with the best fit clusters & corresponding keywords
-    with open('records_to_ldaclusters_v2.csv', 'wb') as f2:
+    with open(records_file, 'wb') as f2:
         writer = csv.writer(f2)
         writer.writerow(["record_index","record_text","five_best_clusters","suggested_keywords"])
 
@@ -168,15 +205,28 @@ if __name__ == '__main__':
         t0 = time()
         print("Finding the best keywords for each record and writing up results...")
 
-        results = lda.transform(tf)
-        for i in range(len(results)):
+        # Only transform the records that aren't already cached for this model
+        cache = TagCache(cache_coll, model_version)
+        cached = cache.getMany(noaa_samples)
+        missing = [i for i in range(len(noaa_samples)) if i not in cached]
+        print("%d records cached, transforming %d..." % (len(cached), len(missing)))
+
+        results = lda.transform(tf[missing]) if missing else []
+        new_entries = []
+        for i, result in zip(missing, results):
+            best_results = (-result).argsort()[:5]
+            keywords = []
+            for x in np.nditer(best_results):
+                keywords.extend(getWords(tf_feature_names, x))
+            cached[i] = (best_results, " ".join(keywords))
+            new_entries.append((noaa_samples[i], best_results, cached[i][1]))
+        cache.putMany(new_entries)
+        cache.evict()
+
+        for i in range(len(noaa_samples)):
             try:
-                best_results = (-results[i]).argsort()[:5]
-                keywords = []
-                for x in np.nditer(best_results):
-                    keywords.extend(getWords(tf_feature_names, x))
-                flattened = " ".join(keywords)
-                writer.writerow([i, noaa_samples[i], best_results, flattened])
+                best_results, flattened = cached[i]
+                writer.writerow([i, noaa_samples[i], np.asarray(best_results), flattened])
             #TODO => need to figure out the Unicode Error
             except UnicodeEncodeError: pass
 
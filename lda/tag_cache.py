@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# tag_cache.py
+#
+#
+# Title:        Tag Suggestion Cache
+# Version:      1.0
+# Organization: Commerce Data Service, U.S. Department of Commerce
+
+
+"""
+Notes: Per-record tag suggestions are stored in MongoDB keyed by the model
+version and a hash of the record text, so an unchanged record under an
+unchanged model costs a lookup instead of an lda.transform. The collection
+is bounded and the least recently used entries are evicted first.
+"""
+
+#####################################################################
+# Imports
+#####################################################################
+from __future__ import print_function  # Not necessary for Python 3
+from time import time
+
+import hashlib
+import pymongo
+from pymongo import ReplaceOne
+
+#####################################################################
+# Global Variables
+#####################################################################
+max_entries = 200000
+batch_size = 10000   # Keys per query/write, well under MongoDB's 16MB limit
+
+
+#####################################################################
+# Helper Functions
+#####################################################################
+def modelVersion(model, feature_names):
+    """
+    Returns a hash of the fitted topic-word weights and the vocabulary,
+    which changes whenever the model would give different suggestions.
+    """
+    h = hashlib.sha1(model.components_.tobytes())
+    for name in feature_names:
+        h.update(name.encode('utf-8') + b"\0")
+    return h.hexdigest()
+
+def recordHash(record_text):
+    """
+    Returns a hash of the record text.
+    """
+    return hashlib.sha1(record_text.encode('utf-8')).hexdigest()
+
+
+#####################################################################
+# Cache
+#####################################################################
+class TagCache(object):
+    """
+    LRU cache of tag suggestions in a MongoDB collection. Each document
+    holds the best clusters and suggested keywords for one
+    (model version, record hash) pair, plus the time it was last used.
+    """
+    def __init__(self, collection, model_version, max_entries=max_entries):
+        self.collection = collection
+        self.model_version = model_version
+        self.max_entries = max_entries
+        self.collection.create_index("last_used")
+
+    def _key(self, record_text):
+        return self.model_version + ":" + recordHash(record_text)
+
+    def _value(self, entry):
+        """
+        Returns the cached (best_clusters, suggested_keywords), with the
+        keywords as utf-8 bytes like lda_tag.getWords produces, so cached
+        and freshly computed rows are written out identically.
+        """
+        keywords = entry["suggested_keywords"]
+        if not isinstance(keywords, str):
+            keywords = keywords.encode('utf-8')
+        return entry["best_clusters"], keywords
+
+    def get(self, record_text):
+        """
+        Returns (best_clusters, suggested_keywords) for the record, or None
+        if it is not cached.
+        """
+        entry = self.collection.find_one_and_update(
+            {"_id": self._key(record_text)}, {"$set": {"last_used": time()}})
+        if entry is None:
+            return None
+        return self._value(entry)
+
+    def getMany(self, records):
+        """
+        Looks up a list of record texts, batch_size keys per query, and
+        returns a dict of list index -> (best_clusters, suggested_keywords)
+        for the hits.
+        """
+        keys = [self._key(r) for r in records]
+        found = {}
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            hits = []
+            for entry in self.collection.find({"_id": {"$in": batch}}):
+                found[entry["_id"]] = self._value(entry)
+                hits.append(entry["_id"])
+            if hits:
+                self.collection.update_many({"_id": {"$in": hits}},
+                                            {"$set": {"last_used": time()}})
+        return dict((i, found[k]) for i, k in enumerate(keys) if k in found)
+
+    def _entry(self, best_clusters, suggested_keywords):
+        return {"best_clusters": [int(x) for x in best_clusters],
+                "suggested_keywords": suggested_keywords,
+                "last_used": time()}
+
+    def put(self, record_text, best_clusters, suggested_keywords):
+        """
+        Stores the suggestions for a record. Call evict() once a batch of
+        puts is done to keep the collection bounded; use putMany for
+        more than a handful of records.
+        """
+        self.collection.replace_one(
+            {"_id": self._key(record_text)},
+            self._entry(best_clusters, suggested_keywords), upsert=True)
+
+    def putMany(self, entries):
+        """
+        Stores a list of (record_text, best_clusters, suggested_keywords)
+        with one bulk write per batch_size records.
+        """
+        for start in range(0, len(entries), batch_size):
+            self.collection.bulk_write(
+                [ReplaceOne({"_id": self._key(r)}, self._entry(c, k), upsert=True)
+                 for r, c, k in entries[start:start + batch_size]],
+                ordered=False)
+
+    def evict(self):
+        """
+        Deletes the least recently used entries beyond max_entries.
+        """
+        excess = self.collection.count() - self.max_entries
+        if excess > 0:
+            stale = [e["_id"] for e in self.collection.find({}, {"_id": 1})
+                     .sort("last_used", pymongo.ASCENDING).limit(excess)]
+            for start in range(0, len(stale), batch_size):
+                self.collection.delete_many({"_id": {"$in": stale[start:start + batch_size]}})
+        return max(excess, 0)
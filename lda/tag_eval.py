@@ -0,0 +1,187 @@
+#!/usr/bin/python
+# tag_eval.py
+#
+#
+# Title:        Tag Recommendation Evaluation
+# Version:      1.0
+# Organization: Commerce Data Service, U.S. Department of Commerce
+
+
+"""
+Notes: Scores suggested tags against each record's held-out keyword field.
+Tags are mapped to token IDs and stored as binary sparse matrices, so the
+per-record set intersections are a single elementwise product. Chunks of
+records are scored in parallel.
+
+Usage: set holdout = True in lda_tag.py and run it first. That trains the
+model without the keyword field and writes records_to_ldaclusters_v2_holdout.csv,
+which is what this script reads. The default records_to_ldaclusters_v2.csv
+comes from a model that saw the keywords, so scoring it would overstate
+precision and recall; this script refuses to do that.
+
+The ranked suggestions are scored, not tag_filter.py's output: tag_filter
+returns an unordered set, so there is no top k to take from it. Records
+lda_tag.py skipped (no suggestions row) are left out of the averages.
+"""
+
+#####################################################################
+# Imports
+#####################################################################
+from __future__ import print_function, division  # Not necessary for Python 3
+from time import time
+
+import os
+import csv
+import pymongo
+import numpy as np
+import scipy.sparse as sp
+from sklearn.externals.joblib import Parallel, delayed
+from sklearn.feature_extraction.text import CountVectorizer
+from lda_tag import stopwords
+
+#####################################################################
+# Global Variables
+#####################################################################
+conn=pymongo.MongoClient()
+db = conn.earthwindfire
+noaa_coll = db.noaa_coll
+
+k_values = [5, 10, 30]
+n_jobs = -1
+chunk_size = 5000
+suggestions_file = 'records_to_ldaclusters_v2_holdout.csv'
+
+# Same tokenization & stop words as lda_tag.py, so held-out keywords only
+# contain terms the model could have suggested
+analyzer = CountVectorizer(stop_words=stopwords).build_analyzer()
+
+
+#####################################################################
+# Helper Functions
+#####################################################################
+def tokenize(phrases):
+    """
+    Splits a list of tags/keyword phrases into unique words with
+    lda_tag.py's analyzer, keeping the order in which they first appear.
+    """
+    seen = set()
+    tokens = []
+    for phrase in phrases:
+        for word in analyzer(phrase):
+            if word not in seen:
+                seen.add(word)
+                tokens.append(word)
+    return tokens
+
+def loadKeywords(collection):
+    """
+    Reads in MongoDB documents and returns the tokenized keyword field of
+    each record, in the same order as lda_tag.wrangleData.
+    """
+    return [tokenize(entry[u'keywords']) for entry in collection.find()]
+
+def loadSuggestions(infile):
+    """
+    Reads the records_to_ldaclusters csv and returns a dict of
+    record_index -> tokenized suggested keywords (best first).
+    """
+    suggestions = {}
+    with open(infile, 'rb') as incsvfile:
+        reader = csv.reader(incsvfile, delimiter=',')
+        next(reader, None)
+        for row in reader:
+            suggestions[int(row[0])] = tokenize([row[3]])
+    return suggestions
+
+def toMatrix(token_lists, vocab, k=None):
+    """
+    Maps lists of tokens to a binary CSR matrix over the token IDs in
+    vocab, keeping only the first k tokens of each list if k is given.
+    """
+    indptr = [0]
+    indices = []
+    for tokens in token_lists:
+        ids = [vocab[t] for t in tokens[:k] if t in vocab]
+        indices.extend(ids)
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.int32)
+    return sp.csr_matrix((data, indices, indptr),
+                         shape=(len(token_lists), len(vocab)))
+
+def scoreChunk(suggested, actual):
+    """
+    Returns the number of correct tags and the number of keywords for each
+    record in one chunk of records.
+    """
+    hits = np.asarray(suggested.multiply(actual).sum(axis=1)).ravel()
+    n_actual = np.diff(actual.indptr)
+    return hits, n_actual
+
+def evaluate(suggestions, keywords, k_values, n_jobs=n_jobs, chunk_size=chunk_size):
+    """
+    Computes precision@k, recall@k and coverage (share of records with at
+    least one correct tag) for each k in k_values, across all records that
+    have both keywords and suggestions. Also reports how many records were
+    scored and how many with keywords were skipped for lack of suggestions.
+    Yields (k, scores) pairs.
+    """
+    with_keywords = [i for i in range(len(keywords)) if keywords[i]]
+    records = [i for i in with_keywords if i in suggestions]
+    n_skipped = len(with_keywords) - len(records)
+    if not records:
+        for k in k_values:
+            yield k, {"precision": 0., "recall": 0., "coverage": 0.,
+                      "n_records": 0, "n_skipped": n_skipped}
+        return
+
+    # The vocabulary and keyword matrix don't depend on k
+    vocab = {}
+    for i in records:
+        for t in keywords[i]:
+            vocab.setdefault(t, len(vocab))
+    actual = toMatrix([keywords[i] for i in records], vocab)
+    suggested_tokens = [suggestions[i] for i in records]
+
+    for k in k_values:
+        suggested = toMatrix(suggested_tokens, vocab, k)
+        results = Parallel(n_jobs=n_jobs)(
+            delayed(scoreChunk)(suggested[s:s + chunk_size], actual[s:s + chunk_size])
+            for s in range(0, len(records), chunk_size))
+        hits = np.concatenate([r[0] for r in results])
+        n_actual = np.concatenate([r[1] for r in results])
+
+        yield k, {
+            "precision": np.mean(hits / k),
+            "recall": np.mean(hits / n_actual),
+            "coverage": np.mean(hits > 0),
+            "n_records": len(records),
+            "n_skipped": n_skipped,
+        }
+
+if __name__ == '__main__':
+    # Start the clock
+    t0 = time()
+
+    if not os.path.exists(suggestions_file):
+        raise SystemExit("%s not found: run lda_tag.py with holdout = True first."
+                         % suggestions_file)
+
+    print("Loading keywords and suggested tags...")
+    keywords = loadKeywords(noaa_coll)
+    suggestions = loadSuggestions(suggestions_file)
+    print("done in %0.3fs." % (time() - t0))
+
+    with open('lda_tag_evaluation.csv', 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(["k","precision","recall","coverage","n_records","n_skipped"])
+
+        # Restart the clock
+        t0 = time()
+        for k, scores in evaluate(suggestions, keywords, k_values):
+            print("k=%d: precision=%0.4f recall=%0.4f coverage=%0.4f "
+                  "over %d records, %d skipped (done in %0.3fs.)"
+                  % (k, scores["precision"], scores["recall"], scores["coverage"],
+                     scores["n_records"], scores["n_skipped"], time() - t0))
+            writer.writerow([k, scores["precision"], scores["recall"],
+                             scores["coverage"], scores["n_records"], scores["n_skipped"]])
+            t0 = time()
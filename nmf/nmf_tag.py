@@ -9,6 +9,11 @@
 
 """
 Notes: In NMF, time complexity is polynomial.
+The mini-batch mode feeds row chunks of the TF-IDF matrix through an
+online NMF, so each update costs O(chunk_size) rather than O(n_samples)
+and no dense n_samples x n_topics matrix is held during fitting. The
+TF-IDF matrix itself is still built in full. It can optionally
+warm-start from components saved by a previous mini-batch run.
 """
 #####################################################################
 # Imports
@@ -16,11 +21,15 @@ Notes: In NMF, time complexity is polynomial.
 from __future__ import print_function # Not necessary for Python 3
 from time import time
 
+import os
 import re
+import csv
 import json
 import string
 import requests
+import numpy as np
 from sklearn.decomposition import NMF
+from sklearn.externals import joblib
 from sklearn.feature_extraction import text
 from sklearn.feature_extraction.text import TfidfVectorizer
 
@@ -30,11 +39,148 @@ from sklearn.feature_extraction.text import TfidfVectorizer
 n_features = 1000
 n_topics = 20
 n_top_words = 30
+chunk_size = 2000
+n_passes = 3
+components_file = "nmf_components.npz"
+model_file = "nmf_model.pkl"     # Fitted vectorizer & model, read by rstag.py
+minibatch = False    # Use MiniBatchNMF instead of sklearn's full-batch NMF
+warm_start = False   # Continue from components_file & its vocabulary (mini-batch only)
 
 domain_stops = ["department","commerce","doc","noaa","national", "data", \
                 "centers", "united", "states", "administration"]
 stopwords = text.ENGLISH_STOP_WORDS.union(domain_stops)
 
+#####################################################################
+# Mini-batch NMF
+#####################################################################
+class MiniBatchNMF(object):
+    """
+    Online NMF that learns the topic-word matrix (components_) from row
+    chunks of the document-term matrix. Each chunk is projected onto the
+    current topics with multiplicative updates, then its sufficient
+    statistics are folded into a running average from which components_
+    is re-estimated. Older chunks are down-weighted by 1 - 1/(t + learning_offset),
+    which tends to 1, and rows are reshuffled each pass so chunks mix records
+    from across the catalog. alpha and l1_ratio regularize both factors,
+    as in sklearn's NMF.
+    """
+    def __init__(self, n_components=n_topics, chunk_size=chunk_size,
+                 n_passes=n_passes, n_inner=10, learning_offset=10.,
+                 alpha=.1, l1_ratio=.5, random_state=1, components=None):
+        self.n_components = n_components
+        self.chunk_size = chunk_size
+        self.n_passes = n_passes
+        self.n_inner = n_inner
+        self.learning_offset = learning_offset
+        self.alpha = alpha
+        self.l1_ratio = l1_ratio
+        self.random_state = random_state
+        self.components_ = components
+        self.n_samples_ = None
+        self._A = None
+        self._B = None
+        self._weight = 0.
+        self._n_chunks = 0
+
+    def _init_components(self, n_features):
+        rng = np.random.RandomState(self.random_state)
+        self.components_ = np.abs(rng.rand(self.n_components, n_features))
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._A = np.zeros(self.components_.shape)
+        self._B = np.zeros((self.n_components, self.n_components))
+        self._weight = 0.
+        self._n_chunks = 0
+
+    def _project(self, X):
+        """
+        Solves for the document-topic weights of the rows in X with
+        components_ held fixed.
+        """
+        H = self.components_
+        l1 = self.alpha * self.l1_ratio
+        l2 = self.alpha * (1. - self.l1_ratio)
+        HHt = np.dot(H, H.T)
+        XHt = np.asarray(X.dot(H.T))
+        W = np.full((X.shape[0], self.n_components),
+                    np.sqrt(max(X.mean(), 1e-10) / self.n_components))
+        for _ in range(self.n_inner):
+            W *= XHt / (np.dot(W, HHt) + l2 * W + l1 + 1e-10)
+        return W
+
+    def partial_fit(self, X):
+        """
+        Updates components_ from a single chunk of rows.
+        """
+        if self.components_ is None:
+            self._init_components(X.shape[1])
+        elif self._A is None:
+            self._reset_stats()
+        W = self._project(X)
+        n_rows = X.shape[0]
+        n_samples = self.n_samples_ or n_rows
+
+        # Running per-record averages of X.T * W and W.T * W
+        self._n_chunks += 1
+        rho = 1. - 1. / (self._n_chunks + self.learning_offset)
+        self._A = rho * self._A + (1. - rho) * np.asarray(X.T.dot(W)).T / n_rows
+        self._B = rho * self._B + (1. - rho) * np.dot(W.T, W) / n_rows
+        self._weight = rho * self._weight + (1. - rho)
+
+        # Multiplicative update for the full-data objective, with the
+        # averages scaled back up to n_samples records
+        l1 = self.alpha * self.l1_ratio
+        l2 = self.alpha * (1. - self.l1_ratio)
+        A = self._A / self._weight
+        B = self._B / self._weight
+        H = self.components_
+        H *= A / (np.dot(B, H) + (l2 * H + l1) / n_samples + 1e-10)
+        return self
+
+    def fit(self, X):
+        """
+        Streams X through partial_fit, chunk_size rows at a time, for
+        n_passes passes over a fresh shuffle of the rows. Starts from
+        components_ if already set.
+        """
+        rng = np.random.RandomState(self.random_state)
+        self.n_samples_ = X.shape[0]
+        for _ in range(self.n_passes):
+            order = rng.permutation(X.shape[0])
+            for start in range(0, X.shape[0], self.chunk_size):
+                self.partial_fit(X[order[start:start + self.chunk_size]])
+        return self
+
+    def transform(self, X):
+        """
+        Returns the document-topic matrix for X, computed chunk by chunk.
+        """
+        return np.vstack([self._project(chunk)
+                          for chunk in iter_chunks(X, self.chunk_size)])
+
+def iter_chunks(matrix, size):
+    """
+    Yields consecutive row slices of a (sparse) matrix.
+    """
+    for start in range(0, matrix.shape[0], size):
+        yield matrix[start:start + size]
+
+def save_components(model, feature_names, path):
+    """
+    Saves the topic-word matrix and its vocabulary so a later run can
+    warm-start from them.
+    """
+    np.savez(path, components=model.components_,
+             feature_names=np.array(feature_names))
+
+def load_components(path):
+    """
+    Loads the topic-word matrix and vocabulary written by save_components.
+    """
+    saved = np.load(path)
+    return saved["components"], list(saved["feature_names"])
+
 #####################################################################
 # Helper Functions
 #####################################################################
@@ -50,6 +196,26 @@ def print_clusters(model, feature_names, n_top_words):
                         for i in topic.argsort()[:-n_top_words - 1:-1]]))
     print()
 
+def assign_tags(model, tfidf, feature_names, n_best=5, n_top_words=n_top_words,
+                chunk_size=chunk_size):
+    """
+    Takes the model, the TF-IDF matrix and the names of the features and
+    yields the best-fit topics and the top words of those topics for
+    each record.
+    """
+    top_words = [[feature_names[i] for i in topic.argsort()[:-n_top_words - 1:-1]]
+                 for topic in model.components_]
+    start = 0
+    for chunk in iter_chunks(tfidf, chunk_size):
+        weights = model.transform(chunk)
+        for i, row in enumerate(weights):
+            best_topics = (-row).argsort()[:n_best]
+            keywords = []
+            for t in best_topics:
+                keywords.extend(top_words[t])
+            yield start + i, best_topics, " ".join(keywords)
+        start += chunk.shape[0]
+
 def load_data(URL):
     """
     Loads the data from URL and returns data in JSON format.
@@ -84,10 +250,21 @@ if __name__ == '__main__':
     # Restart the clock
     t0 = time()
 
+    # Reuse the saved vocabulary & components if asked to
+    components, vocabulary = None, None
+    if minibatch and warm_start and os.path.exists(components_file):
+        components, vocabulary = load_components(components_file)
+        if components.shape[0] != n_topics:
+            print("%s has %d topics, not %d; starting from scratch."
+                  % (components_file, components.shape[0], n_topics))
+            components, vocabulary = None, None
+        else:
+            print("Warm-starting from %s..." % components_file)
+
     # Extract term-frequency, inverse document-frequency features
     print("Extracting term-frequency, inverse document-frequency features for NMF...")
     tfidf_vectorizer = TfidfVectorizer(ngram_range=(1,1), max_df=0.95, min_df=2,
-                                       stop_words=stopwords)
+                                       stop_words=stopwords, vocabulary=vocabulary)
 
     tfidf = tfidf_vectorizer.fit_transform(noaa_samples)
     print("done in %0.3fs." % (time() - t0))
@@ -100,10 +277,37 @@ if __name__ == '__main__':
           "n_samples=%d and n_features=%d..."
           % (len(noaa_samples), n_features))
 
-    nmf = NMF(n_components=n_topics, random_state=1, alpha=.1, l1_ratio=.5).fit(tfidf)
+    if minibatch:
+        nmf = MiniBatchNMF(n_components=n_topics, random_state=1, alpha=.1, l1_ratio=.5,
+                           components=components).fit(tfidf)
+    else:
+        nmf = NMF(n_components=n_topics, random_state=1, alpha=.1, l1_ratio=.5).fit(tfidf)
     print("done in %0.3fs." % (time() - t0))
 
     # Print out the clusters
     print("\nTopics in NMF model:")
     tfidf_feature_names = tfidf_vectorizer.get_feature_names()
     print_clusters(nmf, tfidf_feature_names, n_top_words)
+
+    if minibatch:
+        save_components(nmf, tfidf_feature_names, components_file)
+    # Save components_ rather than the model so MiniBatchNMF (defined in
+    # __main__ here) doesn't need to be importable to read the file
+    joblib.dump({"vectorizer": tfidf_vectorizer, "components": nmf.components_},
+                model_file)
+
+    # Now match up the records with the best fit clusters & corresponding keywords
+    with open('records_to_nmfclusters.csv', 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(["record_index","record_text","five_best_clusters","suggested_keywords"])
+
+        # Restart the clock
+        t0 = time()
+        print("Finding the best keywords for each record and writing up results...")
+
+        for i, best_results, flattened in assign_tags(nmf, tfidf, tfidf_feature_names):
+            try:
+                writer.writerow([i, noaa_samples[i], best_results, flattened])
+            except UnicodeEncodeError: pass
+
+        print("done in %0.3fs." % (time() - t0))